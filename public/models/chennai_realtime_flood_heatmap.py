@@ -4,9 +4,10 @@ chennai_realtime_flood_heatmap.py
 Pipeline:
   1. Load Chennai flood inundation points from KML.
   2. Cluster points into zones (hotspots) using K-Means on lat/lon.
-  3. For each zone center:
+  3. For each zone center (concurrently):
        - Fetch recent rain series from Open-Meteo.
-       - Use pretrained LSTM model to predict next-hour rainfall.
+     Then use pretrained LSTM model to predict next-hour rainfall
+     for all zones in one batched forward pass.
   4. Combine predicted rain + historical avg depth per zone
      => compute real-time flood risk score (0–10).
   5. Render a Folium Chennai zone heatmap with zone colors based on current risk.
@@ -19,20 +20,225 @@ Run example:
 """
 
 import argparse
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from html import unescape
 from pathlib import Path
-import math
+import json
+import re
+import time
 import xml.etree.ElementTree as ET
 
 import numpy as np
 import pandas as pd
 import requests
-from sklearn.cluster import KMeans
+from requests.adapters import HTTPAdapter
+from sklearn.cluster import MiniBatchKMeans
 import folium
 from tensorflow.keras.models import load_model
 
 
 # ------------------------ 1. KML → FLOOD POINTS ------------------------ #
 
+KML_NS = {"kml": "http://www.opengis.net/kml/2.2"}
+PLACEMARK_TAG = "{%s}Placemark" % KML_NS["kml"]
+
+# Above this size the regex fast path (whole file in memory) is skipped
+# in favour of streaming iterparse
+KML_REGEX_MAX_BYTES = 64 * 1024 * 1024
+
+_PLACEMARK_RE = re.compile(r"<Placemark[\s>]")
+_POINT_COORDS_RE = re.compile(
+    r"<Point>\s*<coordinates>\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)"
+)
+_NON_POINT_GEOMETRY_RE = re.compile(r"<(?:LineString|Polygon|MultiGeometry)[\s>]")
+_XML_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+_XML_ENCODING_RE = re.compile(rb"""<\?xml[^>]*\sencoding\s*=\s*["']([^"']+)["']""")
+
+
+def _parse_placemark(pm):
+    """
+    Extract (objectid, lat, lon, depth_in, remarks) from one <Placemark> element.
+    Returns None if the placemark has no usable lat/lon.
+    """
+    ns = KML_NS
+
+    # ExtendedData / SchemaData / SimpleData
+    schema = pm.find("kml:ExtendedData/kml:SchemaData", ns)
+    fields = {}
+    if schema is not None:
+        for sd in schema.findall("kml:SimpleData", ns):
+            name = sd.get("name")
+            val = sd.text.strip() if sd.text else None
+            fields[name] = val
+
+    # Coordinates from Point
+    coord_elem = pm.find("kml:Point/kml:coordinates", ns)
+    lat = lon = None
+    if coord_elem is not None and coord_elem.text:
+        parts = coord_elem.text.strip().split(",")
+        if len(parts) >= 2:
+            lon = float(parts[0])
+            lat = float(parts[1])
+
+    # F_LATITUDE / F_LONGITUDE override if present
+    if "F_LATITUDE" in fields:
+        try:
+            lat = float(fields["F_LATITUDE"])
+        except (TypeError, ValueError):
+            pass
+    if "F_LONGITUDE" in fields:
+        try:
+            lon = float(fields["F_LONGITUDE"])
+        except (TypeError, ValueError):
+            pass
+
+    if lat is None or lon is None:
+        return None  # skip invalid points
+
+    # OBJECTID
+    objid = fields.get("OBJECTID")
+    try:
+        objid = int(objid) if objid is not None else None
+    except ValueError:
+        objid = None
+
+    # DEPTH (inches)
+    depth_str = fields.get("DEPTH")
+    try:
+        depth_in = float(depth_str) if depth_str is not None else 0.0
+    except ValueError:
+        depth_in = 0.0
+
+    # remarks
+    remarks = fields.get("F_REMARKS", "")
+
+    return objid, lat, lon, depth_in, remarks
+
+
+def _simple_data_values(text: str, name: str):
+    """
+    Plain-text values of SimpleData field `name`, or None if the field never
+    appears in the file (in any quoting or form).
+    """
+    if 'name="%s"' % name not in text and "name='%s'" % name not in text:
+        return None
+    return re.findall(r'<SimpleData name="%s">([^<]*)</SimpleData>' % re.escape(name), text)
+
+
+def _load_flood_points_regex(kml_path: Path):
+    """
+    Fast path: pull coordinates and SimpleData fields with regexes, no XML tree.
+    Every Placemark must hold exactly one plain <Point> and every field must be
+    either absent everywhere or readable once per Placemark, so values line up
+    by position; returns None otherwise so the caller can fall back to the
+    full parser. Only UTF-8 files are read here; other encodings fall back too.
+    """
+    raw = kml_path.read_bytes()
+    declared = _XML_ENCODING_RE.search(raw[:256])
+    if declared and declared.group(1).lower() not in (b"utf-8", b"utf8"):
+        return None
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return None
+    # Commented-out markup must not count as placemarks or field values
+    text = _XML_COMMENT_RE.sub("", text)
+
+    n = len(_PLACEMARK_RE.findall(text))
+    if n == 0 or _NON_POINT_GEOMETRY_RE.search(text):
+        return None
+
+    coords = _POINT_COORDS_RE.findall(text)
+    fields = {
+        name: _simple_data_values(text, name)
+        for name in ("OBJECTID", "DEPTH", "F_LATITUDE", "F_LONGITUDE", "F_REMARKS")
+    }
+    # A field that appears anywhere must be readable in every Placemark;
+    # fewer matches means a form the regex can't read (CDATA, quoting, ...)
+    if len(coords) != n or any(v is not None and len(v) != n for v in fields.values()):
+        return None
+
+    def numeric(values):
+        return pd.to_numeric(pd.Series(values, dtype="object").str.strip(), errors="coerce")
+
+    lon = pd.Series([float(c[0]) for c in coords])
+    lat = pd.Series([float(c[1]) for c in coords])
+    # F_LATITUDE / F_LONGITUDE override geometry where they parse
+    if fields["F_LATITUDE"]:
+        lat = numeric(fields["F_LATITUDE"]).fillna(lat)
+    if fields["F_LONGITUDE"]:
+        lon = numeric(fields["F_LONGITUDE"]).fillna(lon)
+
+    if fields["OBJECTID"]:
+        # Same rule as int() in _parse_placemark: anything but an integer -> <NA>
+        ids = pd.Series(fields["OBJECTID"], dtype="object").str.strip()
+        ids = ids.where(ids.str.fullmatch(r"[+-]?\d+").fillna(False).astype(bool))
+        objectids = pd.to_numeric(ids, errors="coerce").astype("Int64")
+    else:
+        objectids = [None] * n
+
+    if fields["F_REMARKS"]:
+        remarks = [unescape(r.strip()) if r else None for r in fields["F_REMARKS"]]
+    else:
+        remarks = ""
+
+    return pd.DataFrame({
+        "objectid": objectids,
+        "lat": lat,
+        "lon": lon,
+        "DEPTH": numeric(fields["DEPTH"]) if fields["DEPTH"] else 0.0,
+        "remarks": remarks,
+    })
+
+
+def _load_flood_points_iterparse(kml_path: Path) -> pd.DataFrame:
+    """
+    Full parser: stream Placemarks with iterparse and detach each once read,
+    so memory stays flat on large KMLs; lat/lon/depth accumulate in compact
+    8-byte float arrays rather than lists of Python floats. Building the
+    DataFrame copies them once into its own block.
+    """
+    lats = array("d")
+    lons = array("d")
+    depths = array("d")
+    objectids = []
+    remarks_list = []
+
+    parents = []
+    for event, elem in ET.iterparse(kml_path, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag != PLACEMARK_TAG:
+            continue
+
+        point = _parse_placemark(elem)
+        # Drop the parsed placemark from the tree so it can be freed
+        if parents:
+            parents[-1].remove(elem)
+        if point is None:
+            continue
+
+        objid, lat, lon, depth_in, remarks = point
+        objectids.append(objid)
+        lats.append(lat)
+        lons.append(lon)
+        depths.append(depth_in)
+        remarks_list.append(remarks)
+
+    # frombuffer only wraps the arrays for pandas; the DataFrame copies them
+    return pd.DataFrame({
+        "objectid": objectids,
+        "lat": np.frombuffer(lats, dtype=np.float64),
+        "lon": np.frombuffer(lons, dtype=np.float64),
+        "DEPTH": np.frombuffer(depths, dtype=np.float64),
+        "remarks": remarks_list,
+    })
+
+
 def load_flood_points_from_kml(kml_path: Path) -> pd.DataFrame:
     """
     Parse KML of Chennai flood points.
@@ -45,79 +251,21 @@ def load_flood_points_from_kml(kml_path: Path) -> pd.DataFrame:
       - F_REMARKS (description)
 
     Also reads geometry from <Point><coordinates>.
+    Files up to KML_REGEX_MAX_BYTES go through a regex fast path, which reads
+    the whole file into memory but skips building any XML tree; larger files,
+    or files the fast path can't read unambiguously, are stream-parsed with
+    iterparse so memory stays flat.
     Returns a DataFrame with columns:
       [objectid, lat, lon, depth_in, remarks]
     """
-    ns = {"kml": "http://www.opengis.net/kml/2.2"}
-    tree = ET.parse(kml_path)
-    root = tree.getroot()
-    placemarks = root.findall(".//kml:Placemark", ns)
-
-    rows = []
-    for pm in placemarks:
-        # ExtendedData / SchemaData / SimpleData
-        schema = pm.find("kml:ExtendedData/kml:SchemaData", ns)
-        fields = {}
-        if schema is not None:
-            for sd in schema.findall("kml:SimpleData", ns):
-                name = sd.get("name")
-                val = sd.text.strip() if sd.text else None
-                fields[name] = val
-
-        # Coordinates from Point
-        coord_elem = pm.find("kml:Point/kml:coordinates", ns)
-        lat = lon = None
-        if coord_elem is not None and coord_elem.text:
-            parts = coord_elem.text.strip().split(",")
-            if len(parts) >= 2:
-                lon = float(parts[0])
-                lat = float(parts[1])
-
-        # F_LATITUDE / F_LONGITUDE override if present
-        if "F_LATITUDE" in fields:
-            try:
-                lat = float(fields["F_LATITUDE"])
-            except (TypeError, ValueError):
-                pass
-        if "F_LONGITUDE" in fields:
-            try:
-                lon = float(fields["F_LONGITUDE"])
-            except (TypeError, ValueError):
-                pass
-
-        if lat is None or lon is None:
-            continue  # skip invalid points
-
-        # OBJECTID
-        objid = fields.get("OBJECTID")
-        try:
-            objid = int(objid) if objid is not None else None
-        except ValueError:
-            objid = None
+    df = None
+    if kml_path.stat().st_size <= KML_REGEX_MAX_BYTES:
+        df = _load_flood_points_regex(kml_path)
+    if df is None:
+        df = _load_flood_points_iterparse(kml_path)
 
-        # DEPTH (inches)
-        depth_str = fields.get("DEPTH")
-        try:
-            depth_in = float(depth_str) if depth_str is not None else 0.0
-        except ValueError:
-            depth_in = 0.0
-
-        # remarks
-        remarks = fields.get("F_REMARKS", "")
-
-        rows.append({
-            "objectid": objid,
-            "lat": lat,
-            "lon": lon,
-            "DEPTH": depth_in,
-            "remarks": remarks,
-        })
-
-    df = pd.DataFrame(rows)
     # Clean up NaNs
     df["DEPTH"] = pd.to_numeric(df["DEPTH"], errors="coerce").fillna(0.0)
-    df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
-    df["lon"] = pd.to_numeric(df["lon"], errors="coerce")
     df = df.dropna(subset=["lat", "lon"])
     df = df.reset_index(drop=True)
 
@@ -129,7 +277,7 @@ def load_flood_points_from_kml(kml_path: Path) -> pd.DataFrame:
 
 def cluster_points_into_zones(points_df: pd.DataFrame, num_zones: int = 12):
     """
-    Cluster point lat/lon into `num_zones` using KMeans.
+    Cluster point lat/lon into `num_zones` using MiniBatchKMeans.
     Returns:
       - points_with_zone: original df + 'zone_id' column
       - zone_summary: per zone aggregated info:
@@ -138,36 +286,58 @@ def cluster_points_into_zones(points_df: pd.DataFrame, num_zones: int = 12):
     df = points_df.copy()
     coords = df[["lat", "lon"]].to_numpy()
 
-    kmeans = KMeans(n_clusters=num_zones, random_state=42, n_init=10)
+    # Mini-batch updates scale to large KMLs; 2D lat/lon needs few restarts
+    kmeans = MiniBatchKMeans(n_clusters=num_zones, batch_size=1024,
+                             random_state=42, n_init=3)
     df["zone_id"] = kmeans.fit_predict(coords)
 
-    zone_rows = []
-    for z in range(num_zones):
-        sub = df[df["zone_id"] == z]
-        if sub.empty:
-            continue
-        center_lat = sub["lat"].mean()
-        center_lon = sub["lon"].mean()
-        avg_depth = sub["DEPTH"].mean()
-        zone_rows.append({
-            "zone_id": z,
-            "center_lat": center_lat,
-            "center_lon": center_lon,
-            "avg_depth_in": avg_depth,
-            "num_points": len(sub),
-        })
-
-    zone_summary = pd.DataFrame(zone_rows)
+    # Single pass over the points; empty clusters simply produce no group
+    zone_summary = (
+        df.groupby("zone_id", sort=True)
+          .agg(center_lat=("lat", "mean"),
+               center_lon=("lon", "mean"),
+               avg_depth_in=("DEPTH", "mean"),
+               num_points=("lat", "size"))
+          .reset_index()
+    )
     print(f"Created {len(zone_summary)} zones from {len(points_df)} points.")
     return df, zone_summary
 
 
 # ------------------------ 3. OPEN-METEO + LSTM PREDICTION ------------------------ #
 
+OPEN_METEO_MAX_WORKERS = 16
+OPEN_METEO_CACHE_TTL_S = 900                      # 15 min
+OPEN_METEO_MAX_RESPONSE_BYTES = 2 * 1024 * 1024   # 2 MB
+
+# Shared session so concurrent zone fetches reuse pooled keep-alive connections
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=OPEN_METEO_MAX_WORKERS,
+                                       pool_maxsize=OPEN_METEO_MAX_WORKERS))
+
+
 def fetch_open_meteo_rain_series(lat: float, lon: float, past_hours: int = 24):
     """
     Fetch recent hourly rain series for location using Open-Meteo.
     Returns list of rain values (mm) from oldest -> latest (length up to past_hours).
+
+    Results are memoised in this process only, per 0.01° lat/lon tile and
+    OPEN_METEO_CACHE_TTL_S window: a later call for the same tile in the same
+    process (e.g. when the module is imported and called repeatedly) reuses
+    the response. Separate CLI runs start with an empty cache, and concurrent
+    calls for one tile are not merged.
+    """
+    bucket = int(time.time()) // OPEN_METEO_CACHE_TTL_S
+    series = _fetch_rain_series_cached(round(lat, 2), round(lon, 2), past_hours, bucket)
+    return list(series)
+
+
+@lru_cache(maxsize=1024)
+def _fetch_rain_series_cached(lat: float, lon: float, past_hours: int, bucket: int):
+    """
+    Cached Open-Meteo fetch; fetch_open_meteo_rain_series rounds lat/lon and
+    computes the TTL window index `bucket`, which only takes part in the cache key.
+    Returns a tuple so cached values cannot be mutated by callers.
     """
     url = "https://api.open-meteo.com/v1/forecast?latitude=13.0878&longitude=80.2785&hourly=temperature_2m,rain,showers,precipitation&minutely_15=precipitation,rain"
     params = {
@@ -179,47 +349,67 @@ def fetch_open_meteo_rain_series(lat: float, lon: float, past_hours: int = 24):
         "timezone": "Asia/Kolkata",
     }
 
-    resp = requests.get(url, params=params, timeout=20)
-    resp.raise_for_status()
-    data = resp.json()
+    # Stream the body with a size cap instead of trusting the server's response size
+    with _session.get(url, params=params, timeout=20, stream=True) as resp:
+        resp.raise_for_status()
+        body = bytearray()
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            body += chunk
+            if len(body) > OPEN_METEO_MAX_RESPONSE_BYTES:
+                raise ValueError(
+                    f"Open-Meteo response exceeds {OPEN_METEO_MAX_RESPONSE_BYTES} bytes"
+                )
+    data = json.loads(body)
 
     times = data.get("hourly", {}).get("time", [])
     rains = data.get("hourly", {}).get("rain", [])
 
     if not times or not rains:
-        return []
+        return ()
 
-    pairs = sorted(zip(times, rains), key=lambda x: x[0])
-    recent = pairs[-past_hours:]
-    series = [float(r) for _, r in recent]
+    # Open-Meteo returns hourly values in chronological order already
+    series = tuple(float(r) for r in rains[-past_hours:])
     return series
 
 
-def build_lstm_input(rain_series, seq_len: int = 24):
+def build_lstm_input(rain_series, seq_len: int = 24, out=None):
     """
     Build input tensor for LSTM (shape: (1, seq_len, 1)) from 1D rain series.
     Left-pad with zeros if not enough history.
+    If `out` is given (e.g. one (seq_len, 1) row of a preallocated batch),
+    it is filled in place and returned instead of allocating a new array.
     """
-    arr = np.array(rain_series, dtype="float32")
-    if len(arr) < seq_len:
-        pad_len = seq_len - len(arr)
-        arr = np.concatenate([np.zeros(pad_len, dtype="float32"), arr])
-    else:
-        arr = arr[-seq_len:]
-    return arr.reshape(1, seq_len, 1)
+    arr = np.asarray(rain_series, dtype="float32")[-seq_len:]
+    x = np.empty((1, seq_len, 1), dtype="float32") if out is None else out
+    start = seq_len - len(arr)
+    x[..., :start, 0] = 0.0
+    x[..., start:, 0] = arr
+    return x
 
 
-def predict_next_rain(model, lat: float, lon: float, seq_len: int = 24) -> float:
+def gather_inputs(lat: float, lon: float, seq_len: int = 24, out=None):
     """
-    Use LSTM model to predict next-hour rainfall for a given location.
+    Fetch recent rain for a location and shape it as one LSTM sample (seq_len, 1),
+    written into `out` when given.
+    Returns None if Open-Meteo has no rain history for the location.
     """
     series = fetch_open_meteo_rain_series(lat, lon, past_hours=seq_len)
     if not series:
-        return 0.0
-    x = build_lstm_input(series, seq_len=seq_len)
-    y = model.predict(x, verbose=0)
-    pred = float(y.squeeze())
-    return max(pred, 0.0)  # no negative rain
+        return None
+    if out is not None:
+        return build_lstm_input(series, seq_len=seq_len, out=out)
+    return build_lstm_input(series, seq_len=seq_len)[0]
+
+
+def predict_batch(model, X: np.ndarray) -> np.ndarray:
+    """
+    Predict next-hour rainfall for a batch of inputs (shape: (N, seq_len, 1))
+    with a single forward pass. Returns an (N,) array of non-negative mm values.
+    """
+    if len(X) == 0:
+        return np.zeros(0, dtype="float32")
+    y = model(X, training=False).numpy().squeeze(-1)
+    return np.maximum(y, 0.0)  # no negative rain
 
 
 # ------------------------ 4. RISK SCORING ------------------------ #
@@ -258,24 +448,27 @@ def build_zone_heatmap(zone_df: pd.DataFrame, output_html: Path):
     center_lon = zone_df["center_lon"].mean()
     m = folium.Map(location=[center_lat, center_lon], zoom_start=11)
 
-    for _, row in zone_df.iterrows():
-        color = risk_to_color(row["risk_score"])
+    # Collect markers in one layer and attach it to the map once
+    zones_layer = folium.FeatureGroup(name="Zones")
+    for row in zone_df.itertuples(index=False):
+        color = risk_to_color(row.risk_score)
         popup = (
-            f"Zone: {row['zone_id']}<br>"
-            f"Avg Depth: {row['avg_depth_in']:.2f} in<br>"
-            f"LSTM Predicted Rain: {row['pred_rain_mm']:.2f} mm<br>"
-            f"Risk Score: {row['risk_score']:.2f}<br>"
-            f"Points in zone: {row['num_points']}"
+            f"Zone: {row.zone_id}<br>"
+            f"Avg Depth: {row.avg_depth_in:.2f} in<br>"
+            f"LSTM Predicted Rain: {row.pred_rain_mm:.2f} mm<br>"
+            f"Risk Score: {row.risk_score:.2f}<br>"
+            f"Points in zone: {row.num_points}"
         )
         folium.CircleMarker(
-            location=[row["center_lat"], row["center_lon"]],
+            location=[row.center_lat, row.center_lon],
             radius=10,
             popup=popup,
             color=color,
             fill=True,
             fill_color=color,
             fill_opacity=0.7,
-        ).add_to(m)
+        ).add_to(zones_layer)
+    zones_layer.add_to(m)
 
     m.save(str(output_html))
     print(f"Saved real-time Chennai zone heatmap -> {output_html}")
@@ -323,24 +516,39 @@ def main():
     model = load_model(str(model_path))
     print("   Model loaded.")
 
-    # Predict rain + compute risk per zone
-    pred_rains = []
-    risks = []
-    for _, row in zone_summary.iterrows():
-        lat = float(row["center_lat"])
-        lon = float(row["center_lon"])
-        avg_depth = float(row["avg_depth_in"])
+    # Fetch LSTM inputs for all zones concurrently, each straight into its row
+    # of one preallocated batch, then predict in one model call
+    rows = list(zone_summary.itertuples(index=False))
+    X = np.zeros((len(rows), args.seq_len, 1), dtype="float32")
+
+    def fetch_zone_input(i, row):
+        lat = float(row.center_lat)
+        lon = float(row.center_lon)
+
+        print(f"   Zone {row.zone_id}: fetching rain for ({lat:.4f}, {lon:.4f})...")
+        try:
+            return gather_inputs(lat, lon, seq_len=args.seq_len, out=X[i]) is not None
+        except Exception as e:
+            print(f"      Error fetching rain for zone {row.zone_id}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=OPEN_METEO_MAX_WORKERS) as executor:
+        has_data = np.fromiter(executor.map(fetch_zone_input, range(len(rows)), rows),
+                               dtype=bool, count=len(rows))
 
-        print(f"   Zone {row['zone_id']}: predicting for ({lat:.4f}, {lon:.4f})...")
+    pred_rains = [0.0] * len(rows)
+    if has_data.any():
         try:
-            pred_mm = predict_next_rain(model, lat, lon, seq_len=args.seq_len)
+            # Zones without rain history keep 0.0 regardless of their (zero) input
+            preds = predict_batch(model, X)
+            pred_rains = np.where(has_data, preds, 0.0).tolist()
         except Exception as e:
-            print(f"      Error predicting for zone {row['zone_id']}: {e}")
-            pred_mm = 0.0
+            print(f"      Error predicting rain for {int(has_data.sum())} zones: {e}")
 
-        risk = compute_risk_score(avg_depth, pred_mm)
-        pred_rains.append(pred_mm)
-        risks.append(risk)
+    risks = [
+        compute_risk_score(float(avg_depth), pred_mm)
+        for avg_depth, pred_mm in zip(zone_summary["avg_depth_in"], pred_rains)
+    ]
 
     zone_summary["pred_rain_mm"] = pred_rains
     zone_summary["risk_score"] = risks
@@ -0,0 +1,126 @@
+"""
+Parity checks for the two KML loaders in chennai_realtime_flood_heatmap.py:
+the regex fast path must either return exactly what the iterparse parser
+returns, or decline (None) so the loader falls back to it.
+"""
+
+import pandas as pd
+import pytest
+
+import chennai_realtime_flood_heatmap as heatmap
+
+
+POINTS = [(13.01, 80.21, "1.5"), (13.02, 80.22, "2.5"), (13.03, 80.23, "3.5")]
+
+
+def placemark(i, lat, lon, depth, depth_tag=None, geometry=None, remarks=None):
+    depth_tag = depth_tag or '<SimpleData name="DEPTH">{}</SimpleData>'
+    geometry = geometry or f"<Point><coordinates>{lon},{lat},0</coordinates></Point>"
+    remarks = remarks or f"spot {i} &amp; road"
+    return (
+        "<Placemark><ExtendedData><SchemaData schemaUrl=\"#s\">"
+        f'<SimpleData name="OBJECTID">{i}</SimpleData>'
+        + depth_tag.format(depth)
+        + f'<SimpleData name="F_REMARKS">{remarks}</SimpleData>'
+        "</SchemaData></ExtendedData>"
+        + geometry
+        + "</Placemark>"
+    )
+
+
+def write_kml(tmp_path, placemarks, encoding="utf-8"):
+    path = tmp_path / "points.kml"
+    path.write_text(
+        f'<?xml version="1.0" encoding="{encoding}"?>\n'
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+        + "\n".join(placemarks)
+        + "</Document></kml>",
+        encoding=encoding,
+    )
+    return path
+
+
+def load_both(path, monkeypatch):
+    fast = heatmap.load_flood_points_from_kml(path)
+    with monkeypatch.context() as m:
+        m.setattr(heatmap, "_load_flood_points_regex", lambda p: None)
+        full = heatmap.load_flood_points_from_kml(path)
+    return fast, full
+
+
+def assert_same(fast, full):
+    # Loaders may differ in objectid dtype (Int64 vs int/object); compare values
+    def as_list(ids):
+        return [None if pd.isna(v) else int(v) for v in ids]
+
+    assert as_list(fast["objectid"]) == as_list(full["objectid"])
+    pd.testing.assert_frame_equal(fast.drop(columns="objectid"),
+                                  full.drop(columns="objectid"), check_dtype=False)
+
+
+def test_plain_points_use_fast_path_and_match_iterparse(tmp_path, monkeypatch):
+    path = write_kml(tmp_path, [placemark(i, *p) for i, p in enumerate(POINTS)])
+
+    assert heatmap._load_flood_points_regex(path) is not None
+    fast, full = load_both(path, monkeypatch)
+    assert_same(fast, full)
+    assert list(full["DEPTH"]) == [1.5, 2.5, 3.5]
+    assert full["remarks"][0] == "spot 0 & road"
+
+
+@pytest.mark.parametrize("depth_tag", [
+    '<SimpleData name="DEPTH"><![CDATA[{}]]></SimpleData>',
+    "<SimpleData name='DEPTH'>{}</SimpleData>",
+])
+def test_unreadable_field_forms_fall_back(tmp_path, monkeypatch, depth_tag):
+    path = write_kml(tmp_path, [placemark(i, *p, depth_tag=depth_tag)
+                                for i, p in enumerate(POINTS)])
+
+    assert heatmap._load_flood_points_regex(path) is None
+    fast, full = load_both(path, monkeypatch)
+    assert_same(fast, full)
+    assert list(fast["DEPTH"]) == [1.5, 2.5, 3.5]
+
+
+def test_non_point_geometry_falls_back(tmp_path, monkeypatch):
+    line = placemark(1, *POINTS[1], geometry=(
+        "<LineString><coordinates>80.30,13.10,0 80.31,13.11,0</coordinates></LineString>"
+    ))
+    path = write_kml(tmp_path, [placemark(0, *POINTS[0]), line])
+
+    assert heatmap._load_flood_points_regex(path) is None
+    fast, full = load_both(path, monkeypatch)
+    assert_same(fast, full)
+    assert len(fast) == 1
+
+
+def test_non_integer_objectid_becomes_missing(tmp_path, monkeypatch):
+    pms = [placemark(i, *p) for i, p in enumerate(POINTS[:2])]
+    pms[1] = pms[1].replace('name="OBJECTID">1<', 'name="OBJECTID">1.5<')
+    path = write_kml(tmp_path, pms)
+
+    assert heatmap._load_flood_points_regex(path) is not None
+    fast, full = load_both(path, monkeypatch)
+    assert_same(fast, full)
+    assert pd.isna(fast["objectid"][1])
+
+
+def test_non_utf8_encoding_falls_back(tmp_path, monkeypatch):
+    path = write_kml(tmp_path, [placemark(i, *p, remarks="café")
+                                for i, p in enumerate(POINTS)], encoding="ISO-8859-1")
+
+    assert heatmap._load_flood_points_regex(path) is None
+    fast, full = load_both(path, monkeypatch)
+    assert_same(fast, full)
+    assert fast["remarks"][0] == "café"
+
+
+def test_commented_out_placemark_is_ignored(tmp_path, monkeypatch):
+    pms = [placemark(i, *p) for i, p in enumerate(POINTS[:2])]
+    pms.append("<!-- " + placemark(2, *POINTS[2]) + " -->")
+    path = write_kml(tmp_path, pms)
+
+    assert heatmap._load_flood_points_regex(path) is not None
+    fast, full = load_both(path, monkeypatch)
+    assert_same(fast, full)
+    assert len(fast) == 2